@@ -0,0 +1,253 @@
+import os
+import re
+import logging
+import asyncio
+import aiofiles
+import httpx
+import numpy as np
+import orjson
+import pandas as pd
+from functools import lru_cache
+from openpyxl import load_workbook
+from telegram.error import RetryAfter
+
+# ---------------- CONFIG ----------------
+WASENDER_API_URL = os.getenv("WASENDER_API_URL", "https://wasenderapi.com/api/send-message")
+WASENDER_API_KEY = os.getenv("WASENDER_API_KEY")
+
+COLUMNS = ("mobile no", "over due", "edi amount", "advance", "customer name", "loan a/c no")
+BATCH_SIZE = 500
+QUEUE_SIZE = 1000
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+LOG_CHUNK_SIZE = 3500  # Telegram rejects messages over 4096 chars
+LOG_SEND_RETRIES = 5
+_NON_DIGIT = re.compile(r"\D")
+
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", 20))
+SEND_RETRIES = 3
+RETRY_BACKOFF = 0.2
+# Only rate limits are retried: a 5xx from a gateway may mean the message
+# already went out, and re-POSTing would send the customer a duplicate
+RETRY_STATUSES = {429}
+
+# One HTTP/2 client for the whole process: sends from every upload are
+# multiplexed over the same kept-alive connection to Wasender. The transport
+# retries failed connects (nothing was sent yet); send_whatsapp() retries
+# RETRY_STATUSES responses
+WASENDER_CLIENT = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=SEND_RETRIES,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+    ),
+    headers={
+        "Authorization": f"Bearer {WASENDER_API_KEY}",
+        "Content-Type": "application/json"
+    },
+    timeout=httpx.Timeout(10.0, connect=3.0),
+)
+
+# ---------------- HELPERS ----------------
+def norm_col(x):
+    return x.replace("\xa0", " ").strip().lower()
+
+def to_num(s):
+    if pd.api.types.is_numeric_dtype(s):
+        return s.fillna(0).astype(float)
+    s = s.astype(str).str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(s, errors="coerce").fillna(0)
+
+def _digits(m):
+    if isinstance(m, str):
+        return _NON_DIGIT.sub("", m)
+    if isinstance(m, (int, float)) and m == m:
+        return f"{int(m)}"
+    return ""
+
+def clean_mobile(s):
+    s = s.map(_digits)
+    s = s.where(~((s.str.len() == 12) & s.str.startswith("91")), s.str[-10:])
+    return s.where((s.str.len() == 10) & s.str[0].isin(list("6789")))
+
+def prepare_rows(df):
+    """
+    Validate the whole sheet in one vectorised pass and return only the
+    rows that should be messaged
+    """
+    def col(name):
+        return df[name] if name in df else pd.Series(None, index=df.index, dtype=object)
+
+    mobile = clean_mobile(col("mobile no"))
+    od = to_num(col("over due"))
+    edi_amt = to_num(col("edi amount"))
+    adv_amt = to_num(col("advance"))
+    payable = edi_amt.to_numpy(np.float64) + od.to_numpy(np.float64) - adv_amt.to_numpy(np.float64)
+    keep = payable > 0
+
+    rows = pd.DataFrame({
+        "mobile": mobile,
+        "name": col("customer name").fillna(""),
+        "loan_no": col("loan a/c no").fillna(""),
+        "advance": adv_amt,
+        "edi": edi_amt,
+        "overdue": od,
+        "payable": payable,
+    })
+    return rows[mobile.notna().to_numpy() & keep]
+
+def fmt_amt(x):
+    try:
+        x = float(x)
+        i = int(x)
+        return str(i) if i == x else f"{x:.2f}"
+    except:
+        return "0"
+
+_MSG_HEAD = (
+    "👋 ప్రియమైన {name} గారు,\n"
+    "మీ Veritas Finance లో ఉన్న {loan_no} లోన్ నంబరుకు పెండింగ్ అమౌంట్ వివరాలు:\n\n"
+).format
+_MSG_BODY = (
+    "💸 అడ్వాన్స్ మొత్తం: ₹{advance}\n"
+    "📌 ఈడీ మొత్తం: ₹{edi}\n"
+    "🔴 ఓవర్‌డ్యూ మొత్తం: ₹{overdue}\n"
+    "✅ చెల్లించవలసిన మొత్తం: ₹{payable}\n\n"
+    "⚠️ దయచేసి వెంటనే చెల్లించండి, లేకపోతే పెనాల్టీలు మరియు CIBIL స్కోర్‌పై ప్రభావం పడుతుంది.\n"
+    "🔗 చెల్లించడానికి లింక్: {link}"
+).format
+
+@lru_cache(maxsize=4096)
+def _msg_body(advance, edi, overdue, payable, link):
+    return _MSG_BODY(
+        advance=fmt_amt(advance), edi=fmt_amt(edi),
+        overdue=fmt_amt(overdue), payable=fmt_amt(payable), link=link
+    )
+
+def build_msg(name, loan_no, advance, edi, overdue, payable, link):
+    return _MSG_HEAD(name=name, loan_no=loan_no) + _msg_body(
+        float(advance), float(edi), float(overdue), float(payable), link
+    )
+
+async def send_whatsapp(mobile, message):
+    """
+    Send WhatsApp message using Wasender API
+    """
+    url = WASENDER_API_URL
+
+    # Add +91 for India if only 10 digits
+    if len(mobile) == 10:
+        mobile = "+91" + mobile
+    elif not mobile.startswith("+"):
+        mobile = "+" + mobile
+
+    payload = {
+        "to": mobile,
+        "text": message
+    }
+
+    try:
+        for attempt in range(SEND_RETRIES + 1):
+            response = await WASENDER_CLIENT.post(url, content=orjson.dumps(payload))
+            if response.status_code in RETRY_STATUSES and attempt < SEND_RETRIES:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            break
+        result = orjson.loads(response.content)
+        logging.info(f"WASENDER response for {mobile}: {result}")
+
+        if response.status_code == 200 and result.get("success", False):
+            return {"success": True}
+        else:
+            return {"error": result.get("message", "Unknown error")}
+    except Exception as e:
+        logging.error(f"WASENDER error for {mobile}: {e}")
+        return {"error": str(e)}
+
+async def download_file(url, filepath):
+    """
+    Stream a Telegram file to disk chunk by chunk instead of buffering it whole
+    """
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0)) as client:
+        async with client.stream("GET", url) as r:
+            r.raise_for_status()
+            async with aiofiles.open(filepath, "wb") as f:
+                async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+
+def iter_batches(filepath, size=BATCH_SIZE):
+    """
+    Stream the first sheet as DataFrames of at most `size` rows, keeping
+    only the columns we use, so memory stays flat regardless of sheet size
+    """
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        # Sheet 0 as pd.read_excel did, not whichever sheet was last active;
+        # read-only mode trusts the stored <dimension>, which exporters get wrong
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, ())
+        new_cols = {c: norm_col(c) for c in header if isinstance(c, str)}
+        # First column wins when two headers normalise to the same name
+        keep, names = [], []
+        for i, c in enumerate(header):
+            name = new_cols.get(c)
+            if name in COLUMNS and name not in names:
+                keep.append(i)
+                names.append(name)
+
+        batch = []
+        for r in rows:
+            if all(v is None for v in r):
+                continue
+            batch.append([r[i] if i < len(r) else None for i in keep])
+            if len(batch) >= size:
+                yield pd.DataFrame(batch, columns=names, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=names, dtype=object)
+    finally:
+        wb.close()
+
+class LogBuffer:
+    """
+    Collects report lines and posts them to a chat in chunks that stay
+    under Telegram's message size limit
+    """
+    def __init__(self, bot, chat_id, parse_mode=None, limit=LOG_CHUNK_SIZE):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.parse_mode = parse_mode
+        self.limit = limit
+        self.buf = []
+        self.size = 0
+        self._send_lock = asyncio.Lock()
+
+    async def add(self, line):
+        if len(line) > self.limit:
+            line = line[:self.limit - 1] + "…"
+        if self.buf and self.size + len(line) + 1 > self.limit:
+            await self.flush()
+        self.buf.append(line)
+        self.size += len(line) + 1
+
+    async def flush(self):
+        if not self.buf:
+            return
+        text = "\n".join(self.buf)
+        self.buf, self.size = [], 0
+        # Chunks go out one at a time, waiting out Telegram's flood control
+        # (about 20 messages a minute per chat) instead of dropping them
+        async with self._send_lock:
+            for attempt in range(LOG_SEND_RETRIES + 1):
+                try:
+                    await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=self.parse_mode)
+                    return
+                except RetryAfter as e:
+                    if attempt == LOG_SEND_RETRIES:
+                        logging.error(f"Failed to post log chunk: {e}")
+                        return
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logging.error(f"Failed to post log chunk: {e}")
+                    return
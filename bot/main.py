@@ -1,13 +1,12 @@
 import os
-import re
 import logging
-import pandas as pd
-import requests
+import asyncio
+from aiohttp import web
 from pathlib import Path
-from flask import Flask, request
-from telegram import Bot, Update
+from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
-import asyncio
+
+from core import QUEUE_SIZE, SEND_CONCURRENCY, WASENDER_CLIENT, LogBuffer, build_msg, download_file, iter_batches, prepare_rows, send_whatsapp
 
 # ---------------- CONFIG ----------------
 ADMIN_ID = int(os.getenv("ADMIN_ID", "123456789"))
@@ -17,9 +16,6 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not set")
 
-WASENDER_API_URL = os.getenv("WASENDER_API_URL", "https://wasenderapi.com/api/send-message")
-WASENDER_API_KEY = os.getenv("WASENDER_API_KEY")
-
 TEMP_DIR = Path("uploads")
 TEMP_DIR.mkdir(exist_ok=True)
 
@@ -27,81 +23,6 @@ PORT = int(os.environ.get("PORT", 5000))
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-bot = Bot(BOT_TOKEN)
-app_flask = Flask(__name__)
-
-# ---------------- HELPERS ----------------
-def to_num(x):
-    try:
-        if pd.isna(x):
-            return 0
-        s = str(x).replace(",", "").strip()
-        return float(s)
-    except:
-        return 0
-
-def clean_mobile(m):
-    s = re.sub(r"\D", "", str(m))
-    if s.startswith("91") and len(s) == 12:
-        s = s[-10:]
-    if len(s) == 10 and s[0] in "6789":
-        return s
-    return None
-
-def fmt_amt(x):
-    try:
-        x = float(x)
-        return str(int(x)) if x.is_integer() else f"{x:.2f}"
-    except:
-        return "0"
-
-def build_msg(name, loan_no, advance, edi, overdue, payable, link):
-    return (
-        f"👋 ప్రియమైన {name} గారు,\n"
-        f"మీ Veritas Finance లో ఉన్న {loan_no} లోన్ నంబరుకు పెండింగ్ అమౌంట్ వివరాలు:\n\n"
-        f"💸 అడ్వాన్స్ మొత్తం: ₹{fmt_amt(advance)}\n"
-        f"📌 ఈడీ మొత్తం: ₹{fmt_amt(edi)}\n"
-        f"🔴 ఓవర్‌డ్యూ మొత్తం: ₹{fmt_amt(overdue)}\n"
-        f"✅ చెల్లించవలసిన మొత్తం: ₹{fmt_amt(payable)}\n\n"
-        f"⚠️ దయచేసి వెంటనే చెల్లించండి, లేకపోతే పెనాల్టీలు మరియు CIBIL స్కోర్‌పై ప్రభావం పడుతుంది.\n"
-        f"🔗 చెల్లించడానికి లింక్: {link}"
-    )
-
-def send_whatsapp(mobile, message):
-    """
-    Send WhatsApp message using Wasender API
-    """
-    url = WASENDER_API_URL
-    api_key = WASENDER_API_KEY
-
-    # Add +91 for India if only 10 digits
-    if len(mobile) == 10:
-        mobile = "+91" + mobile
-    elif not mobile.startswith("+"):
-        mobile = "+" + mobile
-
-    payload = {
-        "to": mobile,
-        "text": message
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        result = response.json()
-        logging.info(f"WASENDER response for {mobile}: {result}")
-
-        if response.status_code == 200 and result.get("success", False):
-            return {"success": True}
-        else:
-            return {"error": result.get("message", "Unknown error")}
-    except Exception as e:
-        logging.error(f"WASENDER error for {mobile}: {e}")
-        return {"error": str(e)}
-
 # ---------------- BOT HANDLERS ----------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
@@ -116,75 +37,109 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     document = update.message.document
     file = await document.get_file()
-    filepath = TEMP_DIR / document.file_name
-    await file.download_to_drive(custom_path=str(filepath))
-    await update.message.reply_text("📂 File received. Processing...")
+    # Unique per update: concurrent uploads may share a file name
+    filepath = TEMP_DIR / f"{update.update_id}_{document.file_unique_id}.xlsx"
+    log = LogBuffer(context.bot, LOG_CHANNEL_ID)
 
     try:
-        df = pd.read_excel(filepath, header=0)
-        df = df.rename(columns=lambda x: str(x).replace("\xa0", " ").strip().lower())
+        await download_file(file.file_path, filepath)
+        await update.message.reply_text("📂 File received. Processing...")
 
         sent_count, skip_count = 0, 0
-        log_lines = ["📊 *WhatsApp Sending Report*"]
-
-        for i, row in df.iterrows():
-            try:
-                mobile_num = clean_mobile(row.get("mobile no"))
-                if not mobile_num:
-                    skip_count += 1
-                    continue
+        await log.add("📊 WhatsApp Sending Report")
 
-                od = to_num(row.get("over due"))
-                edi_amt = to_num(row.get("edi amount"))
-                adv_amt = to_num(row.get("advance"))
+        # Parse and send overlap: the producer fills a bounded queue while
+        # SEND_CONCURRENCY workers drain it, so memory stays at QUEUE_SIZE rows
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
 
-                payable = (edi_amt + od - adv_amt)
-                if payable <= 0:
-                    skip_count += 1
-                    continue
-
-                msg = build_msg(
-                    row.get("customer name") or "Customer",
-                    row.get("loan a/c no") or "—",
-                    adv_amt, edi_amt, od, payable,
-                    PAYMENT_LINK
-                )
-                resp = send_whatsapp(mobile_num, msg)
-
-                if "error" in resp:
-                    log_lines.append(f"❌ {row.get('customer name')} | {mobile_num} | Error: {resp['error']}")
+        async def produce():
+            nonlocal skip_count
+            batches = iter_batches(filepath)
+            try:
+                while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                    rows = prepare_rows(batch)
+                    skip_count += len(batch) - len(rows)
+                    # Plain tuples in prepare_rows() column order
+                    for mobile_num, name, loan_no, adv_amt, edi_amt, od, payable in rows.itertuples(index=False, name=None):
+                        msg = build_msg(
+                            name or "Customer",
+                            loan_no or "—",
+                            adv_amt, edi_amt, od, payable,
+                            PAYMENT_LINK
+                        )
+                        await queue.put((name, mobile_num, msg))
+            finally:
+                batches.close()
+
+        async def consume():
+            nonlocal sent_count, skip_count
+            while True:
+                name, mobile_num, msg = await queue.get()
+                try:
+                    resp = await send_whatsapp(mobile_num, msg)
+                    if "error" in resp:
+                        await log.add(f"❌ {name} | {mobile_num} | Error: {resp['error']}")
+                        skip_count += 1
+                    else:
+                        sent_count += 1
+                        await log.add(f"✅ {name} | {mobile_num} | Sent")
+                except Exception as e:
+                    await log.add(f"❌ {name} | {mobile_num} | Error: {e}")
                     skip_count += 1
-                else:
-                    sent_count += 1
-                    log_lines.append(f"✅ {row.get('customer name')} | {mobile_num} | Sent")
-
-            except Exception as e:
-                log_lines.append(f"❌ {row.get('customer name')} | {row.get('mobile no')} | Error: {e}")
-                skip_count += 1
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(consume()) for _ in range(SEND_CONCURRENCY)]
+        try:
+            await produce()
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
         summary = f"✅ Finished sending.\n📩 Sent: {sent_count}\n⏭️ Skipped: {skip_count}"
         await update.message.reply_text(summary)
-        await bot.send_message(chat_id=LOG_CHANNEL_ID, text="\n".join(log_lines), parse_mode="Markdown")
 
     except Exception as e:
         await update.message.reply_text(f"❌ Error processing file: {e}")
+    finally:
+        # Post whatever was reported, even if processing stopped partway
+        await log.flush()
+        filepath.unlink(missing_ok=True)
 
 # ---------------- TELEGRAM APP ----------------
-tg_app = ApplicationBuilder().token(BOT_TOKEN).build()
+tg_app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
 tg_app.add_handler(CommandHandler("start", start))
 tg_app.add_handler(MessageHandler(filters.Document.FileExtension("xlsx"), handle_file))
 
-# ---------------- FLASK WEBHOOK ----------------
-@app_flask.route(f"/{BOT_TOKEN}", methods=["POST"])
-def webhook():
-    update = Update.de_json(request.get_json(force=True), bot)
-    asyncio.run(tg_app.process_update(update))
-    return "OK"
+# ---------------- WEBHOOK SERVER ----------------
+async def webhook(request):
+    await tg_app.update_queue.put(Update.de_json(await request.json(), tg_app.bot))
+    return web.Response(text="OK")
 
-@app_flask.route("/", methods=["GET"])
-def home():
-    return "Bot is running ✅"
+async def home(request):
+    return web.Response(text="Bot is running ✅")
 
 # ---------------- MAIN ----------------
+async def main():
+    # The web server and the Telegram application share this one event loop;
+    # the application, its bot (getMe included) and their HTTP pools are set
+    # up once here instead of per webhook call
+    web_app = web.Application()
+    web_app.add_routes([web.post(f"/{BOT_TOKEN}", webhook), web.get("/", home)])
+    runner = web.AppRunner(web_app)
+
+    async with tg_app:
+        await tg_app.start()
+        try:
+            await runner.setup()
+            await web.TCPSite(runner, "0.0.0.0", PORT).start()
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await tg_app.stop()
+            await WASENDER_CLIENT.aclose()
+
 if __name__ == "__main__":
-    app_flask.run(host="0.0.0.0", port=PORT)
+    asyncio.run(main())